@@ -0,0 +1,37 @@
+import gc
+import time
+from env import TELEMETRY
+
+class BootProfiler:
+    """Records elapsed time and free heap for each startup phase.
+
+    Import this module first in code.py so the imports phase is measured.
+    Each mark() covers the time since the previous mark; the total is
+    time.monotonic_ns(), which counts from power-on, so the 'ready' mark
+    gives the time-to-first-keypress figure after plug-in.
+    """
+
+    def __init__(self):
+        self.last = time.monotonic_ns()
+        self.phases = []  # (phase, phase_ms, total_ms, mem_free)
+        self.mark('code.py start')
+
+    def mark(self, phase, start=None):
+        """Record the end of a startup phase and log it when TELEMETRY is on.
+
+        Args:
+            phase (str): Name of the phase that just finished
+            start (int, optional): time.monotonic_ns() when the phase began, for
+                phases that don't follow on from the previous mark
+        """
+        now = time.monotonic_ns()
+        phase_ms = (now - (self.last if start is None else start)) / 1_000_000
+        total_ms = now / 1_000_000
+        mem_free = gc.mem_free()
+        self.phases.append((phase, phase_ms, total_ms, mem_free))
+        if TELEMETRY:
+            print(f"Boot {phase}: {phase_ms:.1f}ms, t+{total_ms:.1f}ms since power-on, {mem_free} bytes free")
+        # Don't bill the logging itself to the next phase
+        self.last = time.monotonic_ns()
+
+profiler = BootProfiler()
@@ -1,6 +1,7 @@
-import gc, time
-from adafruit_hid.keycode import Keycode
+# Import the profiler first so every later startup phase is measured
+from bootprof import profiler
 from models import ButtonController
+profiler.mark('imports')
 
 # Initialize and load button definitions
 keyb = ButtonController()
@@ -16,64 +17,91 @@ keyb = ButtonController()
 
 # "Btn_a1": {
 #         "gpio": 0,
+#         "hid": ("keyboard",),  # optional: HID devices the macros use (keyboard / mouse / cc)
 #         "macro_press": lambda: print("short macro triggered"),
 #         "long_press_threshold": 1.2,
 #         "macro_long": lambda: print("long macro triggered"),
-#		  "macro_release": lambda: print("release macro triggered")
+#		  "macro_release": lambda: print("release macro triggered"),
+#         "led": "status"  # flash this LED on press
+#     }
+# "Btn_a2_Mute": {
+#         "gpio": 1,
+#         "hid": ("cc",),
+#         "macro_press": lambda: keyb.consumer_press('MUTE')
 #     }
 
-supercombo = (Keycode.CONTROL, Keycode.ALT, Keycode.COMMAND, Keycode.SHIFT)
-ctrl = Keycode.CONTROL
-cmd = Keycode.COMMAND
+# Modifiers are given by Keycode name so adafruit_hid is only loaded for the HID devices declared below
+supercombo = ('CONTROL', 'ALT', 'COMMAND', 'SHIFT')
+ctrl = 'CONTROL'
+cmd = 'COMMAND'
 
 
 button_map = {
     "Btn_a1_DesktopLeft": {
         "gpio": 13,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(ctrl, 'LEFT_ARROW')
     },
     "Btn_a2_DesktopRight": {
         "gpio": 6,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(ctrl, 'RIGHT_ARROW')
     },
     "Btn_a4_Fullscreen": {
         "gpio": 14,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(supercombo, 'KEYPAD_NINE'),
         "long_press_threshold": 0.25,
         "macro_long":  lambda: keyb.combo_press(supercombo, 'KEYPAD_SEVEN')
     },
     "Btn_b1_terminal": {
         "gpio": 11,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(supercombo, 'T'),
     },
     "Btn_c3_TopHalf": {
         "gpio": 10,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(supercombo, 'UP_ARROW'),
         "long_press_threshold": 0.25,
         "macro_long":  lambda: keyb.combo_press(supercombo, 'KEYPAD_NINE')
     },
     "Btn_d2_LeftHalf": {
         "gpio": 4,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(supercombo, 'LEFT_ARROW')
     },
     "Btn_d3_BottomHalf": {
         "gpio": 12,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(supercombo, 'DOWN_ARROW')
     },
     "Btn_d4_RightHalf": {
         "gpio": 15,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(supercombo, 'RIGHT_ARROW')
     },
     "Btn_e1_MissionControl": {
         "gpio": 5,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(ctrl, "UP_ARROW"),
     },
     "Btn_f1_Spotlight": {
         "gpio": 3,
+        "hid": ("keyboard",),
         "macro_press": lambda: keyb.combo_press(cmd, 'SPACEBAR')
     }
 }
 
+# PWM status LEDs. GPIO 25 is the Pico's onboard LED
+led_map = {
+    "status": {
+        "gpio": 25,
+        "brightness": 0.3,
+        "animation": "breathe"  # off / solid / blink / breathe
+    }
+}
+
 # Encoder map using physical pins and GPIO numbers
 # enc_old = {
 #     "gpio_a": 1,
@@ -86,26 +114,33 @@ button_map = {
 encoder = {
     "gpio_a": 0,
     "gpio_b": 1,
-    "gpio_button": 2
+    "gpio_button": 2,
+    "led": "status"  # pulses once per mode number on mode change
 }
 
+# Optional custom encoder modes. Consumer control modes (cc_cw / cc_ccw) are queued,
+# coalesced and rate limited instead of blocking the scan loop.
+# encoder["modes"] = [
+#     {"label": "Horizontal Scroll", "macro_cw": lambda: keyb.h_scroll(1), "macro_ccw": lambda: keyb.h_scroll(-1),
+#      "hid": ("keyboard", "mouse")},
+#     {"label": "Volume", "cc_cw": "VOLUME_INCREMENT", "cc_ccw": "VOLUME_DECREMENT"},
+#     {"label": "Brightness", "cc_cw": "BRIGHTNESS_INCREMENT", "cc_ccw": "BRIGHTNESS_DECREMENT"}
+# ]
+
 def main():
     print('-------------------------------------------------')
     print("Starting button controller...")
 
-    # Only run one part at a time to isolate the problem
-    print('-----------------------------')
-    print("Adding buttons...")
+    for label, config in led_map.items():
+        keyb.add_led(label, **config)
+    profiler.mark('LED init')
+
     for label, config in button_map.items():
-        print('------------------')
-        print(f"Adding button: {label}")
         keyb.add_button(label, **config)
-        time.sleep(0.01)
-    
-    print('---------------')
-    print(f"Adding encoder")
+    profiler.mark('button registration')
+
     keyb.add_encoder(**encoder)
-    time.sleep(0.01)
+    profiler.mark('encoder init')
 
     print("Starting keyb.run()...")
     keyb.run()
@@ -6,8 +6,21 @@ PRODUCTION_MODE_PIN = board.GP24  # Edit mode toggle switch pin
 # set to True to disable keyboard / mouse output
 TEST_MODE=False 
 # TEST_MODE=True
+
+# ConsumerControl (media key) output queue limits
+CC_MAX_RATE = 30  # Maximum consumer control reports per second
+CC_MAX_BURST = 10  # Maximum queued repeats of a single code
+CC_MAX_PENDING = 4  # Maximum queued bursts before the oldest is dropped
+
+# Status LED animation
+LED_FRAME_RATE = 50  # Animation frames per second
+LED_BUDGET_MS = 1  # Maximum time spent on LED updates per scan pass
+
+# set to True to print timing statistics to the serial console
+TELEMETRY = False
+TELEMETRY_INTERVAL = 5  # Seconds between telemetry reports
+
 production_mode_switch = digitalio.DigitalInOut(PRODUCTION_MODE_PIN)
 production_mode_switch.direction = digitalio.Direction.INPUT
 production_mode_switch.pull = SWITCH_MODE
 
-
@@ -1,23 +1,255 @@
 import time
 import board
 import digitalio
+import pwmio
 import usb_hid
 import rotaryio
 import supervisor
-from adafruit_hid.keyboard import Keyboard
-from adafruit_hid.keycode import Keycode
-from adafruit_hid.mouse import Mouse
-from adafruit_hid.consumer_control import ConsumerControl
-from adafruit_hid.consumer_control_code import ConsumerControlCode
-from env import PRODUCTION_MODE_PIN, SWITCH_MODE, TEST_MODE
+from bootprof import profiler
+from env import PRODUCTION_MODE_PIN, SWITCH_MODE, TEST_MODE, CC_MAX_RATE, CC_MAX_BURST, CC_MAX_PENDING
+from env import LED_FRAME_RATE, LED_BUDGET_MS, TELEMETRY, TELEMETRY_INTERVAL
+
+# supervisor.ticks_ms() wraps at 2**29 ms; compare its values only through ticks_diff()
+_TICKS_PERIOD = 1 << 29
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+def ticks_diff(t1, t2):
+    """Returns the signed difference t1 - t2 in ms between two supervisor.ticks_ms() values"""
+    diff = (t1 - t2) & _TICKS_MAX
+    return ((diff + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+class ConsumerQueue:
+    """Coalescing, rate-limited output queue for ConsumerControl codes.
+
+    Repeated pushes of the same code are merged into a single counted burst,
+    a push of the opposite code (e.g. volume down after volume up) cancels
+    against the newest burst, and the queue never holds more than max_pending
+    bursts. At most one report is sent per call to service(), no faster than
+    max_rate reports per second. This keeps a fast-spinning encoder from
+    flooding the USB endpoint or stalling the scan loop.
+    """
+
+    def __init__(self, cc, max_rate=CC_MAX_RATE, max_burst=CC_MAX_BURST, max_pending=CC_MAX_PENDING):
+        """
+        Args:
+            cc (ConsumerControl): Device the reports are sent through
+            max_rate (float): Maximum number of reports sent per second
+            max_burst (int): Maximum pending count for a single code
+            max_pending (int): Maximum number of queued bursts, oldest are dropped
+        """
+        self.cc = cc
+        self.min_interval_ms = int(1000 / max_rate)
+        self.max_burst = max_burst
+        self.max_pending = max_pending
+        self.pending = []  # [code, count] entries, oldest first
+        self.last_send = None  # supervisor.ticks_ms() of the last report
+
+    def push(self, code, count=1, opposite=None):
+        """Queue count reports of code, merging with the newest pending burst.
+
+        Args:
+            code (int): ConsumerControlCode value to send
+            count (int, optional): Number of times to send it
+            opposite (int, optional): Code that undoes this one; pending counts of it are cancelled first
+        """
+        while count > 0 and self.pending:
+            entry = self.pending[-1]
+            if entry[0] == code:
+                entry[1] = min(entry[1] + count, self.max_burst)
+                return
+            if opposite is None or entry[0] != opposite:
+                break
+            if entry[1] > count:
+                entry[1] -= count
+                return
+            count -= entry[1]
+            self.pending.pop()
+        if count <= 0:
+            return
+        self.pending.append([code, min(count, self.max_burst)])
+        if len(self.pending) > self.max_pending:
+            self.pending.pop(0)
+
+    def service(self):
+        """Send at most one pending report if the rate limit allows it."""
+        if not self.pending:
+            return
+        now = supervisor.ticks_ms()
+        # A negative diff means last_send is over half a ticks period old, so it has expired
+        if self.last_send is not None and 0 <= ticks_diff(now, self.last_send) < self.min_interval_ms:
+            return
+        entry = self.pending[0]
+        self.cc.send(entry[0])
+        self.last_send = now
+        entry[1] -= 1
+        if entry[1] <= 0:
+            self.pending.pop(0)
+
+class StatusLed:
+    """PWM LED driven by non-blocking preset animations.
+
+    Nothing here sleeps. due() is checked once per scan pass and update() only
+    computes and writes a new duty cycle when the next frame is due, so an
+    animation advances one frame at a time without adding latency to input
+    handling. A base animation (off, solid, blink, breathe) runs continuously;
+    one-shot animations (flash, indicate) play over it and then hand back to it.
+    Times are supervisor.ticks_ms() values and levels are integers (0 - 1024),
+    so the per-pass work stays within small ints and doesn't allocate.
+    """
+
+    def __init__(self, pwm, brightness=1.0, frame_rate=LED_FRAME_RATE):
+        """
+        Args:
+            pwm (pwmio.PWMOut): PWM output driving the LED
+            brightness (float): Maximum brightness, 0.0 - 1.0
+            frame_rate (int): Animation frames per second
+        """
+        self.pwm = pwm
+        self.max_duty = int(brightness * 65535)
+        self.frame_ms = 1000 // frame_rate
+        self.next_frame = supervisor.ticks_ms()
+        self.duty = -1
+        self.base = ['off', 0, 0]  # [name, period_ms, start_ticks]
+        self.overlay = None  # (name, count, on_ms, off_ms, start_ticks)
+        self.off()
+
+    def _set_base(self, name, period=0):
+        self.base = [name, max(int(period * 1000), 1), supervisor.ticks_ms()]
+        self.next_frame = supervisor.ticks_ms()
+
+    def off(self):
+        self._set_base('off')
+
+    def solid(self):
+        self._set_base('solid')
+
+    def blink(self, period=1.0):
+        """Blink on and off, once per period seconds."""
+        self._set_base('blink', period)
+
+    def breathe(self, period=3.0):
+        """Fade smoothly up and down, once per period seconds."""
+        self._set_base('breathe', period)
+
+    def flash(self, duration=0.05):
+        """One-shot: full brightness for duration seconds, e.g. on a keypress."""
+        self.overlay = ('flash', 1, int(duration * 1000), 0, supervisor.ticks_ms())
+        self.next_frame = supervisor.ticks_ms()
+
+    def indicate(self, count, on=0.12, off=0.18):
+        """One-shot: pulse count times, e.g. to show the active layer or encoder mode."""
+        self.overlay = ('indicate', count, int(on * 1000), int(off * 1000), supervisor.ticks_ms())
+        self.next_frame = supervisor.ticks_ms()
+
+    def _level(self, now):
+        """Returns the animation level (0 - 1024) for ticks now."""
+        if self.overlay is not None:
+            name, count, on_ms, off_ms, start = self.overlay
+            elapsed = ticks_diff(now, start)
+            if elapsed < count * (on_ms + off_ms):
+                return 1024 if elapsed % (on_ms + off_ms) < on_ms else 0
+            self.overlay = None
+        name, period, start = self.base
+        if name == 'solid':
+            return 1024
+        if name == 'off':
+            return 0
+        elapsed = ticks_diff(now, start)
+        if elapsed >= period:
+            # Rebase on whole periods so elapsed stays within ticks_diff range
+            elapsed %= period
+            self.base[2] = (now - elapsed) & _TICKS_MAX
+        if name == 'blink':
+            return 1024 if elapsed < period // 2 else 0
+        # breathe: triangle wave, squared for a roughly perceptual fade
+        level = 1024 - abs(2048 * elapsed // period - 1024)
+        return level * level >> 10
+
+    def due(self, now):
+        """Returns True if a frame is due at ticks now."""
+        return ticks_diff(now, self.next_frame) >= 0
+
+    def update(self, now):
+        """Render the frame for ticks now and schedule the next one."""
+        self.next_frame = (now + self.frame_ms) & _TICKS_MAX
+        duty = self.max_duty * self._level(now) >> 10
+        if duty != self.duty:
+            self.pwm.duty_cycle = duty
+            self.duty = duty
 
 class ButtonController:
 
-    def __init__(self):
+    def __init__(self, cc_max_rate=CC_MAX_RATE, cc_max_burst=CC_MAX_BURST, cc_max_pending=CC_MAX_PENDING):
         self.buttons = {}
-        self.keyboard = Keyboard(usb_hid.devices)
-        self.mouse = Mouse(usb_hid.devices)
-        self.cc = ConsumerControl(usb_hid.devices)  # For media controls
+        self.leds = {}
+        self._led_order = []
+        self._led_next = 0  # Round-robin start index for the LED time budget
+        self._led_stats = {'passes': 0, 'render_passes': 0, 'frames': 0, 'total_us': 0, 'max_us': 0}
+        self._led_stats_start = supervisor.ticks_ms()
+        self.encoder = None
+        self.enc_led = None
+        self.first_press = False
+        # HID devices and their adafruit_hid modules are only loaded if the keymap declares
+        # them (kbd_key, cc encoder modes, or hid=...). run() builds those before scanning
+        # starts; an undeclared device is still built lazily on first use.
+        self._hid_needed = []
+        self._keyboard = None
+        self._mouse = None
+        self._cc = None
+        self._cc_queue = None
+        self.cc_max_rate = cc_max_rate
+        self.cc_max_burst = cc_max_burst
+        self.cc_max_pending = cc_max_pending
+
+    @property
+    def keyboard(self):
+        if self._keyboard is None:
+            start = time.monotonic_ns()
+            from adafruit_hid.keyboard import Keyboard
+            import adafruit_hid.keycode  # Loaded here so macros never import it mid-keypress
+            self._keyboard = Keyboard(usb_hid.devices)
+            profiler.mark('HID keyboard init', start)
+        return self._keyboard
+
+    @property
+    def mouse(self):
+        if self._mouse is None:
+            start = time.monotonic_ns()
+            from adafruit_hid.mouse import Mouse
+            self._mouse = Mouse(usb_hid.devices)
+            profiler.mark('HID mouse init', start)
+        return self._mouse
+
+    @property
+    def cc(self):
+        """ConsumerControl device, for media controls"""
+        if self._cc is None:
+            start = time.monotonic_ns()
+            from adafruit_hid.consumer_control import ConsumerControl
+            import adafruit_hid.consumer_control_code
+            self._cc = ConsumerControl(usb_hid.devices)
+            profiler.mark('HID consumer control init', start)
+        return self._cc
+
+    @property
+    def cc_queue(self):
+        if self._cc_queue is None:
+            self._cc_queue = ConsumerQueue(self.cc, self.cc_max_rate, self.cc_max_burst, self.cc_max_pending)
+        return self._cc_queue
+
+    def _need_hid(self, *names):
+        """Mark HID devices ('keyboard', 'mouse' or 'cc') as needed before run() starts."""
+        for name in names:
+            if name not in ('keyboard', 'mouse', 'cc'):
+                raise ValueError(f'Unknown HID device {name}, use keyboard, mouse or cc')
+            if name not in self._hid_needed:
+                self._hid_needed.append(name)
+
+    def _init_hid(self):
+        """Build the HID devices declared by the keymap, before scanning starts."""
+        for name in self._hid_needed:
+            getattr(self, name)
 
     def _pinObj(self, gpio):
         """Returns a board.GP* pin object for the given GPIO number"""
@@ -34,14 +266,32 @@ class ButtonController:
         return btn
 
     def _ledObj(self, gpio):
-        """Returns an LED or on/off output object"""
+        """Returns a PWM output object for an LED"""
         pin_obj = self._pinObj(gpio)
-        led = digitalio.DigitalInOut(pin_obj)
-        led.direction = digitalio.Direction.OUTPUT
-        led.pull = SWITCH_MODE
+        return pwmio.PWMOut(pin_obj, frequency=1000, duty_cycle=0)
+
+    def add_led(self, label, gpio, brightness=1.0, animation=None):
+        """Add a PWM status LED to the controller.
+
+        Args:
+            label (str): Label for the LED, referenced by buttons and the encoder
+            gpio (int): GPIO number (0-28)
+            brightness (float, optional): Maximum brightness, 0.0 - 1.0
+            animation (str, optional): Base animation to start: 'off', 'solid', 'blink' or 'breathe'
+
+        Returns:
+            StatusLed: The LED, for starting animations such as breathe()
+        """
+        led = StatusLed(self._ledObj(gpio), brightness)
+        if animation is not None:
+            if animation not in ('off', 'solid', 'blink', 'breathe'):
+                raise ValueError(f'Unknown LED animation {animation}')
+            getattr(led, animation)()
+        self.leds[label] = led
+        self._led_order.append(led)
         return led
 
-    def add_button(self, label, gpio, kbd_key=None, macro_press=None, macro_long=None, macro_release=None, long_press_threshold=None):
+    def add_button(self, label, gpio, kbd_key=None, macro_press=None, macro_long=None, macro_release=None, long_press_threshold=None, led=None, hid=None):
         """Add a button to the controller.
         
         Args:   
@@ -52,6 +302,9 @@ class ButtonController:
             macro_press (callable, optional): Function to call on short press
             macro_long (callable, optional): Function to call on long press
             macro_release (callable, optional): Function to call on button release
+            led (str, optional): Label of an LED to flash on press
+            hid (tuple, optional): HID devices the macros use ('keyboard', 'mouse', 'cc'),
+                built before run() starts scanning
             
         Raises:
             ValueError: If pin configuration is invalid or if using PRODUCTION_MODE_PIN
@@ -59,6 +312,8 @@ class ButtonController:
         
         # print('---------------------------------')
         # print(f"Add Button - {label}")
+        if kbd_key:
+            from adafruit_hid.keycode import Keycode
         button = self._btnObj(gpio)
         btn = {
             'pin': button,
@@ -69,7 +324,8 @@ class ButtonController:
             'macro_press': macro_press,
             'macro_long': macro_long,
             'macro_release': macro_release,
-            'macro_long_ran': False
+            'macro_long_ran': False,
+            'led': self.leds[led] if led else None
         }
         
         # print(f"GPIO{gpio}")
@@ -77,10 +333,26 @@ class ButtonController:
             raise ValueError('Must specify either kbd_key or macro_press/macro_long/macro_release')
         if btn['kbd_key'] is not None and (btn['macro_press'] is not None or btn['long_press_threshold'] is not None or btn['macro_release'] is not None):
             raise ValueError('For advanced usage, use macro_press/macro_long/macro_release instead of kbd_key')
+        if btn['kbd_key'] is not None:
+            self._need_hid('keyboard')
+        if hid:
+            self._need_hid(*hid)
         self.buttons[label] = btn      
     
 
+    def consumer_press(self, code, count=1):
+        """Queue a consumer control code (e.g. 'VOLUME_INCREMENT') to be sent.
+
+        Args:
+            code (str): Name of a ConsumerControlCode constant
+            count (int, optional): Number of times to send it
+        """
+        if not TEST_MODE:
+            from adafruit_hid.consumer_control_code import ConsumerControlCode
+            self.cc_queue.push(getattr(ConsumerControlCode, code), count)
+
     def h_scroll(self, dir):
+        from adafruit_hid.keycode import Keycode
         mod_key = Keycode.SHIFT
         self.keyboard.press(mod_key)
         time.sleep(.0001)
@@ -88,28 +360,54 @@ class ButtonController:
         time.sleep(.0001)
         self.keyboard.release(mod_key)
 
-    def add_encoder(self, gpio_a, gpio_b, gpio_button):
+    def add_encoder(self, gpio_a, gpio_b, gpio_button, modes=None, led=None):
+        """Add a rotary encoder to the controller.
+
+        Args:
+            gpio_a (int): GPIO number for encoder pin A
+            gpio_b (int): GPIO number for encoder pin B
+            gpio_button (int, optional): GPIO number for the push button that cycles modes
+            modes (list, optional): Encoder modes, each a dict with 'label' and either
+                'macro_cw'/'macro_ccw' callables or 'cc_cw'/'cc_ccw' ConsumerControlCode
+                names, plus optional 'reverse' and 'hid' (HID devices the macros use).
+                Defaults to horizontal scroll and zoom.
+            led (str, optional): Label of an LED that pulses enc_mode + 1 times on mode change
+        """
         # print('---------------------------------')
         # print(f"Add encoder")    
         self.encoder = rotaryio.IncrementalEncoder(self._pinObj(gpio_a), self._pinObj(gpio_b))
         self.enc_last_position = None
-        self.enc_mode = 0 # gpio_button switches between modes 0 and 1
-        self.enc_actions = [
+        self.enc_mode = 0 # gpio_button cycles through enc_actions
+        # Copy the mode dicts so resolving code names doesn't modify the caller's modes
+        self.enc_actions = [dict(action) for action in modes or [
             {
                 'label': "Horizontal Scroll",
                 'macro_cw': lambda: self.h_scroll(1),
                 'macro_ccw': lambda: self.h_scroll(-1),
+                'hid': ('keyboard', 'mouse'),
                 'gpio_led': None,
                 'reverse': False
             },
             {
                 'label': "Zoom",
-                'macro_cw': lambda: self.combo_press(Keycode.COMMAND, 'EQUALS'),
-                'macro_ccw': lambda: self.combo_press(Keycode.COMMAND, 'MINUS'),
+                'macro_cw': lambda: self.combo_press('COMMAND', 'EQUALS'),
+                'macro_ccw': lambda: self.combo_press('COMMAND', 'MINUS'),
+                'hid': ('keyboard',),
                 'gpio_led': None,
                 'reverse': False
             }
-        ]
+        ]]
+        for action in self.enc_actions:
+            if 'cc_cw' in action:
+                from adafruit_hid.consumer_control_code import ConsumerControlCode
+                action['cc_cw'] = getattr(ConsumerControlCode, action['cc_cw'])
+                action['cc_ccw'] = getattr(ConsumerControlCode, action['cc_ccw'])
+                self._need_hid('cc')
+            elif 'macro_cw' not in action or 'macro_ccw' not in action:
+                raise ValueError('Encoder modes need macro_cw/macro_ccw or cc_cw/cc_ccw')
+            self._need_hid(*action.get('hid', ()))
+            action.setdefault('gpio_led', None)
+            action.setdefault('reverse', False)
         # print(f"GPIO_A: {gpio_a}, GPIO_B: {gpio_b}")
         if gpio_button:
             self.enc_btn = self._btnObj(gpio_button)
@@ -117,12 +415,16 @@ class ButtonController:
         else:
             self.enc_btn = None
         self.enc_btn_pressed = False
+        self.enc_led = self.leds[led] if led else None
         
     def combo_press(self, combo, key, t=.001):
+        from adafruit_hid.keycode import Keycode
         k = getattr(Keycode, key)
         # Ensure combo is a tuple even if a single key is passed
         if not isinstance(combo, (list, tuple)):
             combo = (combo,)
+        # Modifiers may be given as Keycode values or names
+        combo = [getattr(Keycode, c) if isinstance(c, str) else c for c in combo]
         self.keyboard.press(*combo, k)
         time.sleep(t)
         self.keyboard.release(*combo, k)
@@ -140,14 +442,13 @@ class ButtonController:
                 current_state = not current_state
             if current_state == True and self.enc_btn_pressed == False:
                 # encoder button pressed
-                if self.enc_mode == 0:
-                    self.enc_mode = 1
-                else:
-                    self.enc_mode = 0
+                self.enc_mode = (self.enc_mode + 1) % len(self.enc_actions)
                 self.enc_btn_pressed = True
+                if self.enc_led is not None:
+                    self.enc_led.indicate(self.enc_mode + 1)
                 # print(f"encoder mode change to {self.enc_actions[self.enc_mode]['label']}")
-        if current_state == False:
-            self.enc_btn_pressed = False
+            if current_state == False:
+                self.enc_btn_pressed = False
         logline = f"Encoder {self.encoder.position}"
         if self.encoder.position != self.enc_last_position:
             # Calculate number of steps moved
@@ -156,7 +457,15 @@ class ButtonController:
             if action['reverse'] is True:
                 steps = steps * -1
             # print(f"macro_cw type: {type(action['macro_cw'])}, macro_ccw type: {type(action['macro_ccw'])}")
-            if steps < 0:
+            if 'cc_cw' in action:
+                # Consumer control: queue a counted burst, no blocking sleeps
+                logline = f"{logline} {'CCW' if steps < 0 else 'CW'}"
+                if not TEST_MODE:
+                    if steps < 0:
+                        self.cc_queue.push(action['cc_ccw'], -steps, action['cc_cw'])
+                    else:
+                        self.cc_queue.push(action['cc_cw'], steps, action['cc_ccw'])
+            elif steps < 0:
                 # CounterClockwise
                 logline = f"{logline} CCW"
                 if not TEST_MODE:
@@ -198,7 +507,9 @@ class ButtonController:
                 # print(f"{logline} pressed")
                 # start the buttons timer
                 btn_obj['last_change'] = current_time
-                
+                if not self.first_press:
+                    press_ns = time.monotonic_ns()
+
                 # If it's a keyboard key, press it
                 if btn_obj['kbd_key']:
                     # print(f"{logline} kbd_key: {btn_obj['kbd_key']} pressed")
@@ -209,6 +520,13 @@ class ButtonController:
                     # print(f"{logline} macro_press executed")
                     if not TEST_MODE:
                         btn_obj['macro_press']()
+                # Status feedback only after the report has gone out
+                if btn_obj['led'] is not None:
+                    btn_obj['led'].flash()
+                # Latency from detecting the first press to sending its report
+                if not self.first_press:
+                    profiler.mark('first keypress report', press_ns)
+                    self.first_press = True
             # Button released
             else:
                 # If it's a keyboard key, release it
@@ -230,8 +548,57 @@ class ButtonController:
             if not TEST_MODE:
                 btn_obj['macro_long']()  
             btn_obj['macro_long_ran'] = True
+
+    def _update_leds(self):
+        """Advance due LED animations within LED_BUDGET_MS and record the cost of this pass."""
+        if not self._led_order:
+            return
+        now = supervisor.ticks_ms()
+        count = len(self._led_order)
+        frames = 0
+        start_ns = 0
+        # Round-robin so LEDs skipped when the budget runs out go first next pass
+        for i in range(count):
+            idx = (self._led_next + i) % count
+            led = self._led_order[idx]
+            if not led.due(now):
+                continue
+            if TELEMETRY and frames == 0:
+                # Only passes that render are timed, idle passes are a ticks comparison
+                start_ns = time.monotonic_ns()
+            led.update(now)
+            frames += 1
+            if ticks_diff(supervisor.ticks_ms(), now) >= LED_BUDGET_MS:
+                self._led_next = (idx + 1) % count
+                break
+        if TELEMETRY:
+            self._record_led_stats(now, frames, start_ns)
+
+    def _record_led_stats(self, now, frames, start_ns):
+        """Accumulate LED update cost and print a summary every TELEMETRY_INTERVAL seconds."""
+        stats = self._led_stats
+        stats['passes'] += 1
+        if frames:
+            cost_us = (time.monotonic_ns() - start_ns) // 1000
+            stats['render_passes'] += 1
+            stats['frames'] += frames
+            stats['total_us'] += cost_us
+            if cost_us > stats['max_us']:
+                stats['max_us'] = cost_us
+        if ticks_diff(now, self._led_stats_start) >= TELEMETRY_INTERVAL * 1000:
+            avg_us = stats['total_us'] // stats['render_passes'] if stats['render_passes'] else 0
+            print(f"LED update: {stats['passes']} passes, {stats['render_passes']} rendering, "
+                  f"{stats['frames']} frames, avg {avg_us}us, max {stats['max_us']}us per rendering pass")
+            for key in stats:
+                stats[key] = 0
+            self._led_stats_start = now
+
     def run(self):
         """Main loop to handle all button and encoder events."""
+        if not TEST_MODE:
+            self._init_hid()
+        # Time-to-first-keypress: from here on a press is sent without further setup
+        profiler.mark('ready')
         while True:
             if supervisor.runtime.serial_bytes_available:  # Check if Ctrl+C was sent
                 break  # Exit the loop and stop the program
@@ -239,6 +606,11 @@ class ButtonController:
             for label, btn_obj in self.buttons.items():
                 self._handle_key(label, btn_obj)
             self._handle_encoder()
+            # Drain at most one queued consumer control report
+            if self._cc_queue is not None:
+                self._cc_queue.service()
+            # Advance status LED animations by at most one frame each
+            self._update_leds()
             
             # Small delay to prevent excessive CPU usage
             time.sleep(0.0002)